@@ -2,28 +2,458 @@
 # wolfospealain, May 2018.
 # https://github.com/wolfospealain/apt-task
 
-import argparse
+import bisect
+import collections.abc
+import contextlib
+import functools
+import io
+import mmap
+import struct
 import sys
 import os
-import subprocess
+import heapq
+import itertools
+import time
+import zlib
+from array import array
 
 version = "1.0"
 install_path = "/usr/local/bin"
+cache_path = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "apt-task", "db.pickle")
+cache_version = 6
+socket_path = os.path.join(os.environ.get("XDG_RUNTIME_DIR", os.environ.get("TMPDIR", "/tmp")),
+                           "apt-task-%d.sock" % os.getuid())
+socket_timeout = 10
+request_timeout = 2
+commands = ("install", "remove", "independent", "show", "list", "available", "orphans", "free", "report")
+task_commands = ("install", "remove", "show")
+bit_flags = bytes.maketrans(b"01", b"\x00\x01")
+snapshot_magic = b"apt-task snapshot 2\n"
+package_classes = ("child", "orphan", "independent")
+child_marks = bytes.maketrans(b"\x00\x01\x03", b"\x00\x00\x01")
+orphan_marks = bytes.maketrans(b"\x00\x01\x03", b"\x00\x01\x00")
+fleet_apt = None
+purge_command = "sudo apt purge $(dpkg --get-selections | grep deinstall | cut -f 1)"
+
+
+def memoized(method):
+    """
+    Cache query method results per Apt instance until invalidated; results are shared and must not be modified.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        if key in self._memo:
+            self.memo_hits += 1
+            return self._memo[key]
+        self.memo_misses += 1
+        result = self._memo[key] = method(self, *args, **kwargs)
+        return result
+
+    return wrapper
+
+
+class lazy:
+    """
+    Compute Apt attribute on first access, timed as a phase, then store it on the instance until deleted.
+    """
+
+    def __init__(self, method):
+        self.method = method
+        functools.update_wrapper(self, method)
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        with instance.phase(self.method.__name__):
+            value = instance.__dict__[self.method.__name__] = self.method(instance)
+        return value
+
+
+class Timings:
+    """
+    Collects wall time of nested named phases, with peak resident memory of the process so far, or peak traced
+    memory of each phase when tracing memory (slow).
+    """
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.phases = []
+        self._stack = []
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Time enclosed code as a phase, nested within any enclosing phase.
+        """
+        record = {"phase": name, "depth": len(self._stack), "seconds": None, "peak": None}
+        self.phases.append(record)
+        if self.memory:
+            import tracemalloc
+            if self._stack:
+                self._stack[-1]["peak"] = max(self._stack[-1]["peak"] or 0, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self._stack.pop()
+            if self.memory:
+                record["peak"] = max(record["peak"] or 0, tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"] or 0, record["peak"])
+            else:
+                record["peak"] = peak_rss()
+
+    def report(self, file=sys.stderr):
+        """
+        Print phase wall times and peak traced memory, or peak resident memory at the end of each phase.
+        """
+        print("phase".ljust(40), "seconds".rjust(9), ("peak memory" if self.memory else "peak RSS").rjust(12),
+              file=file)
+        for record in self.phases:
+            peak = human(record["peak"]) if record["peak"] is not None else "-"
+            print(("  " * record["depth"] + record["phase"]).ljust(40), ("%.4f" % record["seconds"]).rjust(9),
+                  peak.rjust(12), file=file)
+
+
+def peak_rss():
+    """
+    Return peak resident memory of the process so far in bytes, or None where not reported.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Progress:
+    """
+    Shows packages parsed and parsing rate on a terminal line, redrawn at most every interval seconds.
+    """
+
+    def __init__(self, label="Parsing apt-cache ... ", file=sys.stdout, interval=0.2):
+        self.label = label
+        self.file = file
+        self.interval = interval
+        self.count = 0
+        self.start = time.perf_counter()
+        self.shown = self.start
+        self.width = len(label)
+
+    def update(self, count):
+        """
+        Add count packages parsed, redrawing the line if due.
+        """
+        self.count += count
+        now = time.perf_counter()
+        if now - self.shown >= self.interval:
+            self.shown = now
+            text = self.label + "%d packages, %d packages/s" % (self.count, self.count / (now - self.start))
+            print("\r" + text.ljust(self.width), end="", file=self.file, flush=True)
+            self.width = max(self.width, len(text))
+
+    def clear(self):
+        """
+        Blank the line.
+        """
+        print("\r" + " " * self.width + "\r", end="", file=self.file, flush=True)
+
+
+@contextlib.contextmanager
+def profiled(path):
+    """
+    Profile enclosed code, dumping cProfile statistics to file.
+    """
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+class PackageDB(collections.abc.Mapping):
+    """
+    Stores package data in columns indexed by integer package ID, with interned names, mapping names to Package views.
+    Packages named only in dependencies have IDs but are not in the database.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+        self.known = array("B")
+        self.sizes = array("L")
+        self.installed = array("B")
+        self.metapackages = array("B")
+        self.tasks = []
+        self.depends = []
+        self.recommends = []
+        self.suggests = []
+        self.requires = []
+        self._task_tuples = {(): ()}
+        self._relation_tuples = {(): ()}
+        self._count = 0
+
+    def id(self, name):
+        """
+        Return package ID for name, allocating an ID not in the database for new names.
+        """
+        if name not in self.ids:
+            name = sys.intern(name)
+            self.ids[name] = len(self.names)
+            self.names.append(name)
+            for column in (self.known, self.sizes, self.installed, self.metapackages):
+                column.append(0)
+            self.tasks.append(())
+            self.depends.append(())
+            self.recommends.append(())
+            self.suggests.append(())
+            self.requires.append(())
+        return self.ids[name]
+
+    def add(self, name):
+        """
+        Add package to database, returning package ID.
+        """
+        package = self.id(name)
+        if not self.known[package]:
+            self.known[package] = 1
+            self._count += 1
+        return package
+
+    def add_tasks(self, package, tasks):
+        """
+        Add tasks to package, sharing interned task name tuples.
+        """
+        tasks = tuple(sorted(set(self.tasks[package]).union(sys.intern(task) for task in tasks)))
+        self.tasks[package] = self._task_tuples.setdefault(tasks, tasks)
+
+    def add_relations(self, package, column, alternatives):
+        """
+        Add relationship field alternatives (Depends, Recommends, Suggests) to package column, packed as interned
+        tuples of package ID tuples.
+        """
+        ids = self.ids
+        relations = getattr(self, column)
+        relations_ids = tuple(tuple(ids[name] if name in ids else self.id(name) for name in names)
+                              for names in alternatives)
+        if relations[package]:
+            relations_ids = tuple(dict.fromkeys(relations[package] + relations_ids))
+        relations[package] = self._relation_tuples.setdefault(relations_ids, relations_ids)
+
+    def add_requires(self, package, alternatives):
+        """
+        Add required package names, every alternative included, packed as a tuple of package IDs.
+        """
+        ids = self.ids
+        requires = self.requires[package] + tuple(ids[name] if name in ids else self.id(name)
+                                                  for names in alternatives for name in names)
+        self.requires[package] = tuple(dict.fromkeys(requires))
+
+    def resolve(self, package, columns=("depends", "recommends", "suggests")):
+        """
+        Return set of package IDs for package relationship columns, choosing the first installed alternative, or the
+        first alternative where none installed.
+        """
+        resolved = set()
+        for column in columns:
+            for alternatives in getattr(self, column)[package]:
+                for alternative in alternatives:
+                    if self.installed[alternative]:
+                        resolved.add(alternative)
+                        break
+                else:
+                    resolved.add(alternatives[0])
+        return resolved
+
+    def parse(self, lines, installed=None, progress=None):
+        """
+        Parse package stanza lines (bytes) into database, adding to installed set from any status fields, and
+        counting packages to any progress display.
+        """
+        package = None
+        stanzas = 0
+        for line in lines:
+            if line[:8] == b"Package:":
+                package = self.add(line[9:].strip().decode())
+                stanzas += 1
+                if stanzas == 1024 and progress:
+                    progress.update(stanzas)
+                    stanzas = 0
+            elif line[:15] == b"Installed-Size:":
+                self.sizes[package] = int(line[16:])
+            elif line[:5] == b"Task:":
+                self.add_tasks(package, line[6:].strip().decode().split(", "))
+            elif line[:8] == b"Section:" and b"metapackage" in line:
+                self.metapackages[package] = 1
+            elif line[:8] == b"Depends:":
+                alternatives = relations(line[9:].strip())
+                self.add_relations(package, "depends", alternatives)
+                self.add_requires(package, alternatives)
+            elif line[:12] == b"Pre-Depends:":
+                self.add_requires(package, relations(line[13:].strip()))
+            elif line[:9] == b"Suggests:":
+                self.add_relations(package, "suggests", relations(line[10:].strip()))
+            elif line[:11] == b"Recommends:":
+                self.add_relations(package, "recommends", relations(line[12:].strip()))
+            elif line[:7] == b"Status:" and installed is not None:
+                if line.split()[3] == b"installed":
+                    installed.update([self.names[package]])
+        if progress:
+            progress.update(stanzas)
+        return self
+
+    def allocate(self, names):
+        """
+        Return array of package IDs for names, allocating IDs not in the database for new names in order.
+        """
+        ids = list(map(self.ids.get, names))
+        for index, package in enumerate(ids):
+            if package is None:
+                ids[index] = self.id(names[index])
+        return array("L", ids)
+
+    def renumbered(self, ids):
+        """
+        Return package data of packages in database renumbered to package IDs in another database, ids indexed by
+        package ID here: package IDs, sizes, metapackage flags, tasks, and relationship and requires columns.
+        """
+        packages = list(itertools.compress(range(len(self.names)), self.known))
+        remap = ids.__getitem__
+        partial = {
+            "packages": array("L", map(remap, packages)),
+            "sizes": array("L", map(self.sizes.__getitem__, packages)),
+            "metapackages": bytes(map(self.metapackages.__getitem__, packages)),
+            "tasks": list(map(self.tasks.__getitem__, packages)),
+            "requires": [tuple(map(remap, self.requires[package])) for package in packages],
+        }
+        for column in ("depends", "recommends", "suggests"):
+            relations = getattr(self, column)
+            partial[column] = [tuple([tuple(map(remap, alternatives)) for alternatives in relations[package]])
+                               for package in packages]
+        return partial
+
+    def merge(self, partial):
+        """
+        Merge renumbered package data parsed from later stanzas, as if parsed in sequence.
+        """
+        known = self.known
+        columns = (self.depends, self.recommends, self.suggests)
+        task_tuples = self._task_tuples
+        for package, tasks, requires, *relations in zip(partial["packages"], partial["tasks"], partial["requires"],
+                                                        partial["depends"], partial["recommends"], partial["suggests"]):
+            if not known[package]:
+                known[package] = 1
+                self.tasks[package] = task_tuples.setdefault(tasks, tasks)
+                self.depends[package], self.recommends[package], self.suggests[package] = relations
+                self.requires[package] = requires
+            else:
+                if tasks:
+                    self.add_tasks(package, tasks)
+                for column, relations_ids in zip(columns, relations):
+                    if relations_ids:
+                        relations_ids = tuple(dict.fromkeys(column[package] + relations_ids))
+                        column[package] = self._relation_tuples.setdefault(relations_ids, relations_ids)
+                if requires:
+                    self.requires[package] = tuple(dict.fromkeys(self.requires[package] + requires))
+        for package, size in itertools.compress(zip(partial["packages"], partial["sizes"]), partial["sizes"]):
+            self.sizes[package] = size
+        for package in itertools.compress(partial["packages"], partial["metapackages"]):
+            self.metapackages[package] = 1
+        self._count = known.count(1)
+        return self
+
+    def __getitem__(self, name):
+        package = self.ids.get(name)
+        if package is None or not self.known[package]:
+            raise KeyError(name)
+        return Package(self, package)
+
+    def __contains__(self, name):
+        package = self.ids.get(name)
+        return package is not None and self.known[package] == 1
+
+    def __iter__(self):
+        for package, name in enumerate(self.names):
+            if self.known[package]:
+                yield name
+
+    def __len__(self):
+        return self._count
 
 
 class Package:
     """
-    Stores package data: tasks, metapackages, depends, installation, size.
+    Package data view on package database: tasks, metapackage, relationships, installation, size.
     """
+    __slots__ = ("db", "id")
 
-    def __init__(self, name, sections=[], tasks=[], installed=False, metapackage=False, size=0):
-        self.name = name
-        self.sections = set(sections)
-        self.tasks = set(tasks)
-        self.installed = installed
-        self.metapackage = metapackage
-        self.size = size
-        self.depends = set()
+    def __init__(self, db, id):
+        self.db = db
+        self.id = id
+
+    @property
+    def name(self):
+        return self.db.names[self.id]
+
+    @property
+    def tasks(self):
+        return frozenset(self.db.tasks[self.id])
+
+    def relations(self, column):
+        return tuple(tuple(self.db.names[alternative] for alternative in alternatives)
+                     for alternatives in getattr(self.db, column)[self.id])
+
+    @property
+    def depends(self):
+        return self.relations("depends")
+
+    @property
+    def recommends(self):
+        return self.relations("recommends")
+
+    @property
+    def suggests(self):
+        return self.relations("suggests")
+
+    @property
+    def packages(self):
+        return frozenset(self.db.names[package] for package in self.db.resolve(self.id))
+
+    @property
+    def installed(self):
+        return self.db.installed[self.id] == 1
+
+    @installed.setter
+    def installed(self, value):
+        self.db.installed[self.id] = 1 if value else 0
+
+    @property
+    def metapackage(self):
+        return self.db.metapackages[self.id] == 1
+
+    @metapackage.setter
+    def metapackage(self, value):
+        self.db.metapackages[self.id] = 1 if value else 0
+
+    @property
+    def size(self):
+        return self.db.sizes[self.id]
+
+    @size.setter
+    def size(self, value):
+        self.db.sizes[self.id] = value
 
     def in_task(self, search):
         for task in self.tasks:
@@ -36,6 +466,7 @@ class Task:
     """
     Stores task packages, installed and available.
     """
+    __slots__ = ("name", "packages", "installed")
 
     def __init__(self, name, packages=set(), installed=set()):
         self.name = name
@@ -43,96 +474,581 @@ class Task:
         self.installed = installed
 
 
+class Dependencies:
+    """
+    Stores the reverse-dependency index of requirements (Depends, Pre-Depends) between installed packages and, built
+    on first use, their strongly connected components, condensing dependency cycles, with the transitive closure of
+    each component cached as a bitset of the components it requires.
+    """
+
+    def __init__(self, packages_db):
+        self.packages_db = packages_db
+        installed = packages_db.installed
+        requires = packages_db.requires
+        self.rdepends = {}
+        for package in itertools.compress(range(len(installed)), installed):
+            for require in requires[package]:
+                if installed[require]:
+                    self.rdepends.setdefault(require, []).append(package)
+        self.components = None
+        self.component_requires = None
+        self.closures = {}
+
+    def condense(self):
+        """
+        Number strongly connected components of installed packages, required components first, and index the
+        requirements between components.
+        """
+        installed = self.packages_db.installed
+        requires = self.packages_db.requires
+        edges = {package: [require for require in requires[package] if installed[require]]
+                 for package in itertools.compress(range(len(installed)), installed)}
+        self.components = strongly_connected(edges)
+        self.component_requires = [set() for component in range(max(self.components.values(), default=-1) + 1)]
+        for package, component in self.components.items():
+            for require in edges[package]:
+                if self.components[require] != component:
+                    self.component_requires[component].add(self.components[require])
+
+    def closure(self, component):
+        """
+        Return bitset of components required by component directly or transitively, itself included, computing
+        closures not yet cached for it and its requirements in order, required components first.
+        """
+        if component not in self.closures:
+            found = {component}
+            pending = [component]
+            while pending:
+                for require in self.component_requires[pending.pop()]:
+                    if require not in self.closures and require not in found:
+                        found.add(require)
+                        pending.append(require)
+            for node in sorted(found):
+                bits = 1 << node
+                for require in self.component_requires[node]:
+                    bits |= self.closures[require]
+                self.closures[node] = bits
+        return self.closures[component]
+
+    def needed(self, packages):
+        """
+        Return set of packages, from installed packages to be removed, still required directly or transitively by
+        other installed packages: in the closure of a package to be removed that a kept package requires, so that a
+        dependency cycle is only removed as a whole.
+        """
+        ids = {self.packages_db.ids[package] for package in packages}
+        required = [package for package in ids
+                    if any(dependent not in ids for dependent in self.rdepends.get(package, ()))]
+        if not required:
+            return set()
+        if self.components is None:
+            self.condense()
+        reached = 0
+        for component in {self.components[package] for package in required}:
+            reached |= self.closure(component)
+        names = self.packages_db.names
+        return {names[package] for package in ids if reached >> self.components[package] & 1}
+
+
+class TasksDB(collections.abc.Mapping):
+    """
+    Maps task names to Task objects, materialized on first access from the task package ID index.
+    """
+
+    def __init__(self, packages_db, index):
+        self.packages_db = packages_db
+        self.index = index
+        self.tasks = {}
+
+    def __getitem__(self, task):
+        if task not in self.tasks:
+            names = self.packages_db.names
+            installed = self.packages_db.installed
+            packages = self.index[task]
+            self.tasks[task] = Task(task, {names[package] for package in packages},
+                                    {names[package] for package in packages if installed[package]})
+        return self.tasks[task]
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self):
+        return len(self.index)
+
+
+class Overlaps:
+    """
+    Stores installed packages of tasks and/or metapackages as bitsets of package IDs, and the overlap matrix of
+    installed tasks and metapackages.
+    """
+
+    def __init__(self, apt):
+        self.apt = apt
+        self.packages = sorted(apt.packages_db)
+        self.ids = {package: index for index, package in enumerate(self.packages)}
+        self.members = sorted(set(apt.installed_tasks) | set(apt.installed_metapackages))
+        self.sizes = array("L", (apt.packages_db.sizes[apt.packages_db.ids[package]] for package in self.packages))
+        self.bitsets = {}
+        self.matrix = {}
+        for member in self.members:
+            self.matrix[member] = {}
+            bits = self.bitset(member)
+            for other in self.matrix:
+                if other != member:
+                    count = popcount(bits & self.bitsets[other])
+                    self.matrix[member][other] = count
+                    self.matrix[other][member] = count
+
+    def bitset(self, task):
+        """
+        Return bitset of installed packages for task and/or metapackage.
+        """
+        if task not in self.bitsets:
+            flags = bytearray(len(self.packages) // 8 + 1)
+            for package in self.apt.installed_packages(task):
+                index = self.ids[package]
+                flags[index >> 3] |= 1 << (index & 7)
+            self.bitsets[task] = int.from_bytes(flags, "little")
+        return self.bitsets[task]
+
+    def names(self, bits):
+        """
+        List package names, sorted, for bitset.
+        """
+        return [self.packages[index] for index in bit_indexes(bits)]
+
+    def size(self, bits):
+        """
+        Return combined installed size (kilobytes) of packages in bitset, summed over the size column.
+        """
+        return sum(itertools.compress(self.sizes, bin(bits)[:1:-1].encode().translate(bit_flags)))
+
+    def others(self, task):
+        """
+        List installed tasks and metapackages other than task and its equivalent metapackage.
+        """
+        metapackage = self.apt.equivalent_metapackage(task)
+        return [other for other in self.members if other != task and other != metapackage]
+
+    def counts(self, task):
+        """
+        Return database of other installed tasks and metapackages and number of overlapping packages.
+        """
+        if task not in self.matrix:
+            bits = self.bitset(task)
+            self.matrix[task] = {other: popcount(bits & self.bitsets[other]) for other in self.members}
+        return {other: self.matrix[task][other] for other in self.others(task)}
+
+    def overlapping(self, task):
+        """
+        Return database of other installed tasks and metapackages and bitsets of overlapping packages.
+        """
+        bits = self.bitset(task)
+        return {other: bits & self.bitsets[other] for other in self.others(task)}
+
+    def removable(self, task):
+        """
+        Return bitset of installed packages for task and/or metapackage not in other installed tasks and metapackages.
+        """
+        bits = self.bitset(task)
+        for other in self.others(task):
+            bits &= ~self.bitsets[other]
+        return bits
+
+
 class Apt:
     _prefix = "ubuntu-"
+    _lists = "/var/lib/apt/lists"
+    _status = "/var/lib/dpkg/status"
+    _pkgcache = "/var/cache/apt/pkgcache.bin"
+    _cached = ("packages_db", "task_index")
+    _derived = ("installed", "installed_metapackages", "installed_tasks", "tasks_db", "overlaps", "dependencies")
 
-    def __init__(self):
-        self.packages_db = self._apt_cache()
-        self.metapackages = self._metapackages()
-        self.installed_metapackages = self._metapackages(installed_only=True)
-        self.tasks = self._tasks()
-        self.tasks_db = {}
-        for task in self.tasks:
-            self.tasks_db[task] = Task(task, self._task_packages(task), self._task_packages(task, installed_only=True))
-        self.installed_tasks = self._tasks(installed_only=True)
+    def __init__(self, root="/", cache=True, rebuild_cache=False, timings=None, jobs=1, progress=None):
+        self.root = root
+        self.jobs = jobs
+        self.timings = timings
+        self.progress = progress
+        self._memo = {}
+        self.memo_hits = 0
+        self.memo_misses = 0
+        with self.phase("signature"):
+            self.signature = self._signature()
+        with self.phase("load cache"):
+            loaded = cache and not rebuild_cache and self._load_cache(self.signature)
+        if not loaded:
+            with self.phase("parse"):
+                self.packages_db = self._apt_cache()
+            if cache:
+                with self.phase("save cache"):
+                    self._save_cache(self.signature)
+
+    def phase(self, name):
+        """
+        Return context timing enclosed code as a phase, if collecting timings.
+        """
+        return self.timings.phase(name) if self.timings else contextlib.nullcontext()
+
+    def changed(self):
+        """
+        Return what has changed since loading or refreshing: "lists" for apt package lists, "status" for dpkg status
+        only, or None. A dpkg status change needs the lists reloaded too when the database came from apt-cache, or
+        when it installs packages missing from the database, which refresh() cannot add.
+        """
+        signature = self._signature()
+        if signature[:-1] != self.signature[:-1]:
+            return "lists"
+        elif signature != self.signature:
+            if not self._package_lists() or any(name not in self.packages_db for name in self._read_installed()):
+                return "lists"
+            return "status"
+        return None
+
+    def refresh(self, status=None):
+        """
+        Update installed packages from dpkg status, or another dpkg status file, adjusting only the tasks and
+        metapackages of changed packages. Return set of changed package names.
+        """
+        if status is None:
+            self.signature = self._signature()
+        db = self.packages_db
+        installed = set()
+        for name in self._read_installed(status):
+            if name in db:
+                installed.add(db.ids[name])
+        changed = installed.symmetric_difference(itertools.compress(itertools.count(), db.installed))
+        if not changed:
+            return set()
+        self._memo.clear()
+        self.__dict__.pop("overlaps", None)
+        self.__dict__.pop("dependencies", None)
+        tasks = set()
+        for package in changed:
+            db.installed[package] = 1 if package in installed else 0
+            tasks.update(db.tasks[package])
+            if db.metapackages[package]:
+                metapackage = db.names[package]
+                for task in (metapackage, metapackage[len(self._prefix):]):
+                    if task in self.task_index and self.equivalent_metapackage(task) == metapackage:
+                        tasks.add(task)
+                if "installed_metapackages" in self.__dict__:
+                    update(self.installed_metapackages, metapackage, package in installed)
+        names = {db.names[package] for package in changed}
+        if "installed" in self.__dict__:
+            self.installed.difference_update(names)
+            self.installed.update(name for name in names if db.ids[name] in installed)
+        if "tasks_db" in self.__dict__:
+            for task in tasks.intersection(self.tasks_db.tasks):
+                members = self.tasks_db.tasks[task].packages & names
+                self.tasks_db.tasks[task].installed.difference_update(members)
+                self.tasks_db.tasks[task].installed.update(name for name in members if db.ids[name] in installed)
+        if "installed_tasks" in self.__dict__:
+            for task in tasks:
+                update(self.installed_tasks, task, self._task_installed(task))
+        return names
+
+    def invalidate(self):
+        """
+        Discard cached query results and tables derived from installed packages, after installed packages change.
+        """
+        self._memo.clear()
+        for attribute in self._derived:
+            self.__dict__.pop(attribute, None)
+
+    def memo_info(self):
+        """
+        Return cached query result hits, misses and size.
+        """
+        return {"hits": self.memo_hits, "misses": self.memo_misses, "size": len(self._memo)}
+
+    def _signature(self):
+        """
+        Return modification times and sizes of apt package lists, compressed or not, and dpkg status, to check cache
+        freshness. Without uncompressed lists, apt-cache results also depend on the apt package cache.
+        """
+        paths = self._package_lists("*_Packages*")
+        if not self._package_lists():
+            paths.append(self._path(self._pkgcache))
+        signature = []
+        for path in paths + [self._path(self._status)]:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                signature.append((path, None, None))
+        return signature
+
+    def _load_cache(self, signature):
+        """
+        Load databases from cache file if current, returning success.
+        """
+        import pickle
+        try:
+            with open(cache_path, "rb") as file:
+                data = pickle.load(file)
+        except Exception:
+            return False
+        if data.get("version") != cache_version or data.get("signature") != signature:
+            return False
+        for attribute in self._cached:
+            setattr(self, attribute, data[attribute])
+        return True
+
+    def _save_cache(self, signature):
+        """
+        Save databases to cache file, replacing atomically; failure is not an error.
+        """
+        import pickle
+        import tempfile
+        data = {"version": cache_version, "signature": signature}
+        for attribute in self._cached:
+            data[attribute] = getattr(self, attribute)
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(cache_path))
+        except OSError:
+            return
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                pickle.dump(data, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, cache_path)
+        except (OSError, pickle.PicklingError):
+            pass
+        finally:
+            with contextlib.suppress(OSError):
+                os.unlink(temporary)
+
+    def _path(self, path):
+        """
+        Return system path relative to root directory.
+        """
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def _package_lists(self, pattern="*_Packages"):
+        """
+        List apt package list files, uncompressed unless pattern matches others.
+        """
+        import glob
+        return sorted(glob.glob(os.path.join(self._path(self._lists), pattern)))
 
     def _apt_cache(self):
         """
-        Return package database parsed from apt-cache results.
+        Return package database read from apt package lists and dpkg status, or parsed from apt-cache results.
         """
-        dpkg_command = ["dpkg-query", "-W", "-f", "${Package} ${Status}\n"]
+        import concurrent.futures
+        import subprocess
+        lists = self._package_lists()
+        if lists and self.jobs > 1:
+            with self.phase("read package lists and dpkg status"):
+                db, installed = self._read_parallel(lists + [self._path(self._status)])
+        elif lists:
+            db = PackageDB()
+            installed = set()
+            for phase, paths in (("read package lists", lists), ("read dpkg status", [self._path(self._status)])):
+                with self.phase(phase):
+                    for path in paths:
+                        try:
+                            with open(path, "rb") as file:
+                                db.parse(file, installed, self.progress)
+                        except OSError:
+                            print("Error reading \"" + path + "\"\n")
+                            exit(1)
+        if lists:
+            for package in installed:
+                db[package].installed = True
+            return db
         apt_cache_command = ["apt-cache", "show", "."]
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            dpkg_query = executor.submit(self._read_installed)
+            try:
+                with self.phase("apt-cache"):
+                    process = subprocess.Popen(apt_cache_command, stdout=subprocess.PIPE)
+                    with process.stdout:
+                        db = PackageDB().parse(process.stdout, progress=self.progress)
+                    if process.wait():
+                        raise subprocess.CalledProcessError(process.returncode, apt_cache_command)
+            except:
+                print("Error running \"" + ' '.join(apt_cache_command) + "\"\n")
+                exit(1)
+            with self.phase("dpkg-query"):
+                installed = dpkg_query.result()
+        for package in installed:
+            if package in db:
+                db[package].installed = True
+        return db
+
+    def _read_parallel(self, paths):
+        """
+        Return package database and installed packages parsed from files by worker processes, each parsing a
+        contiguous share of byte ranges split on stanza boundaries. Package IDs are allocated here from each worker's
+        names in file order, and workers renumber their package data to them, so merging only stores values.
+        """
+        import multiprocessing
+        ranges = []
         try:
-            installed = set()
-            for line in subprocess.check_output(dpkg_command).decode("utf-8").split("\n"):
-                if line and line.split()[3] == "installed":
-                    installed.update([line.split()[0]])
-        except:
-            print("Error running \"" + ' '.join(dpkg_command) + "\"\n")
+            total = sum(os.path.getsize(path) for path in paths)
+            for path in paths:
+                ranges.extend(stanza_ranges(path, max(1 << 18, total // (self.jobs * 16))))
+        except OSError as error:
+            print("Error reading \"" + str(error.filename) + "\"\n")
             exit(1)
+        shares = [[] for job in range(self.jobs)]
+        position = 0
+        for path, start, end in ranges:
+            shares[min(position * self.jobs // max(total, 1), self.jobs - 1)].append((path, start, end))
+            position += end - start
+        workers = []
+        for share in shares:
+            if share:
+                connection, worker_connection = multiprocessing.Pipe()
+                process = multiprocessing.Process(target=parse_share, args=(worker_connection, share), daemon=True)
+                process.start()
+                worker_connection.close()
+                workers.append((process, connection))
+        db = PackageDB()
+        installed = set()
         try:
-            text = subprocess.check_output(apt_cache_command).decode("utf-8")
+            for process, connection in workers:
+                connection.send(db.allocate(received(connection)))
+            for process, connection in workers:
+                partial, partial_installed = received(connection)
+                db.merge(partial)
+                if self.progress:
+                    self.progress.update(len(partial["packages"]))
+                installed.update(db.names[package] for package in partial_installed)
+                process.join()
+        except OSError as error:
+            print("Error reading \"" + str(error.filename) + "\"\n")
+            exit(1)
+        except EOFError:
+            print("Error parsing package lists\n")
+            exit(1)
+        return db, installed
+
+    def _read_installed(self, path=None):
+        """
+        Return set of installed packages read from dpkg status, or dpkg status file, or parsed from dpkg-query
+        results.
+        """
+        import subprocess
+        installed = set()
+        if path or self._package_lists():
+            path = path or self._path(self._status)
+            package = ""
+            try:
+                with open(path, "rb") as file:
+                    for line in file:
+                        if line[:8] == b"Package:":
+                            package = line[9:].strip().decode()
+                        elif line[:7] == b"Status:" and line.split()[3] == b"installed":
+                            installed.update([package])
+            except OSError:
+                print("Error reading \"" + path + "\"\n")
+                exit(1)
+            return installed
+        dpkg_command = ["dpkg-query", "-W", "-f", "${Package} ${Status}\n"]
+        try:
+            process = subprocess.Popen(dpkg_command, stdout=subprocess.PIPE)
+            with process.stdout:
+                for line in process.stdout:
+                    fields = line.split()
+                    if fields and fields[3] == b"installed":
+                        installed.update([fields[0].decode()])
+            if process.wait():
+                raise subprocess.CalledProcessError(process.returncode, dpkg_command)
         except:
-            print("Error running \"" + ' '.join(apt_cache_command) + "\"\n")
+            print("Error running \"" + ' '.join(dpkg_command) + "\"\n")
             exit(1)
-        db = {}
-        package = ""
-        for line in text.splitlines():
-            if line[:8] == "Package:":
-                package = line.split()[1]
-                if package not in db:
-                    db[package] = Package(package, installed=package in installed)
-            elif line[:15] == "Installed-Size:":
-                db[package].size = int(line[16:])
-            elif line[:5] == "Task:":
-                db[package].tasks.update(line[6:].split(", "))
-            elif line[:8] == "Section:" and "metapackage" in line:
-                db[package].metapackage = True
-            elif line[:8] == "Depends:":
-                for depend in line[9:].split(", "):
-                    name = depend.split(" (")[0]
-                    db[package].depends.update([name])
-            elif line[:9] == "Suggests:":
-                db[package].depends.update(line[10:].split(", "))
-            elif line[:11] == "Recommends:":
-                db[package].depends.update(line[12:].split(", "))
-        return db
+        return installed
 
-    def _tasks(self, installed_only=False):
+    @lazy
+    def task_index(self):
         """
-        List tasks, all available or installed only.
+        Index task package IDs in a single pass over the package database.
         """
-        tasks = set()
-        if not installed_only:
-            for item in self.packages_db:
-                tasks.update(self.packages_db[item].tasks)
-        else:
-            for task in self.tasks:
-                status = self.task_status(task)
-                if status[0]:
-                    tasks.update([task])
-        return sorted(tasks)
+        index = {}
+        for package, tasks in enumerate(self.packages_db.tasks):
+            for task in tasks:
+                if task not in index:
+                    index[task] = array("L")
+                index[task].append(package)
+        return index
 
-    def _task_packages(self, task, installed_only=False):
+    @lazy
+    def tasks(self):
         """
-        List task packages, all available or installed only.
+        List available tasks.
         """
-        packages = set()
-        for item in self.packages_db:
-            if not installed_only or self.packages_db[item].installed:
-                if task in self.packages_db[item].tasks or (task == None and self.packages_db[item].tasks == set()):
-                    packages.update([self.packages_db[item].name])
-        return sorted(packages)
+        return sorted(self.task_index)
+
+    @lazy
+    def tasks_db(self):
+        """
+        Task database, materializing tasks on access.
+        """
+        return TasksDB(self.packages_db, self.task_index)
+
+    @lazy
+    def metapackages(self):
+        """
+        List available metapackages.
+        """
+        return sorted(itertools.compress(self.packages_db.names, self.packages_db.metapackages))
+
+    @lazy
+    def installed(self):
+        """
+        Set of installed packages.
+        """
+        return set(itertools.compress(self.packages_db.names, self.packages_db.installed))
+
+    @lazy
+    def installed_metapackages(self):
+        """
+        List installed metapackages.
+        """
+        installed = self.packages_db.installed
+        ids = self.packages_db.ids
+        return [metapackage for metapackage in self.metapackages if installed[ids[metapackage]]]
+
+    @lazy
+    def installed_tasks(self):
+        """
+        List installed tasks: all packages installed, or equivalent metapackage installed.
+        """
+        return [task for task in self.tasks if self._task_installed(task)]
+
+    def _task_installed(self, task):
+        """
+        Return whether task is installed: all packages installed, or equivalent metapackage installed.
+        """
+        installed = self.packages_db.installed
+        metapackage = self.equivalent_metapackage(task)
+        if metapackage and self.packages_db[metapackage].installed:
+            return True
+        return all(map(installed.__getitem__, self.task_index[task]))
+
+    @lazy
+    def dependencies(self):
+        """
+        Requirement graph of installed packages.
+        """
+        return Dependencies(self.packages_db)
+
+    @lazy
+    def overlaps(self):
+        """
+        Overlap engine for installed tasks and metapackages.
+        """
+        return Overlaps(self)
 
     def size(self, packages):
         """
-        Return the combined installed size (kilobytes) of a list of pacakges.
+        Return the combined installed size (kilobytes) of a list of pacakges, summed over the size column.
         """
-        kilobytes = 0
-        for package in packages:
-            kilobytes += self.packages_db[package].size
-        return kilobytes
+        return sum(map(self.packages_db.sizes.__getitem__, map(self.packages_db.ids.__getitem__, packages)))
 
+    @memoized
     def task_status(self, task):
         """
         Return task status, percentage of packages installed, and list of any extra packages from equivalent metapackage.
@@ -142,7 +1058,8 @@ class Apt:
         if metapackage:
             if self.packages_db[metapackage].installed:
                 metapackage_installed = True
-        percentage = len(self.tasks_db[task].installed) / len(self.tasks_db[task].packages) * 100
+        index = self.task_index[task]
+        percentage = sum(map(self.packages_db.installed.__getitem__, index)) / len(index) * 100
         if percentage == 100 or metapackage_installed:
             task_installed = True
         elif metapackage:
@@ -156,17 +1073,14 @@ class Apt:
         else:
             return [task_installed, percentage]
 
+    @memoized
     def metapackage_status(self, metapackage):
         """
         Return install status, percentage of packages installed, and list of any extra packages from equivalent task.
         """
-        depends = self.metapackage_packages(metapackage)
-        installed_depends = 0
-        for package in depends:
-            if package in self.packages_db:
-                if self.packages_db[package].installed:
-                    installed_depends += 1
-        percentage = installed_depends / len(depends) * 100
+        depends = self.packages_db.resolve(self.packages_db.ids[metapackage])
+        installed = self.packages_db.installed
+        percentage = sum(map(installed.__getitem__, depends)) / len(depends) * 100
         if metapackage in self.tasks:
             task = metapackage
         elif metapackage[:7] == self._prefix and metapackage[7:] in self.tasks:
@@ -180,31 +1094,20 @@ class Apt:
         else:
             return [self.packages_db[metapackage].installed, percentage]
 
-    def _metapackages(self, installed_only=False):
-        """
-        List metapackages, all available or installed only.
-        """
-        metapackages = set()
-        for item in self.packages_db:
-            if (not installed_only or self.packages_db[item].installed) and self.packages_db[item].metapackage:
-                metapackages.update([item])
-        return sorted(metapackages)
-
     def metapackage_packages(self, metapackage, installed_only=False):
         """
-        List metapackage packages, all available or installed only.
+        List metapackage packages (Depends, Recommends, Suggests), all available or installed only.
         """
+        names = self.packages_db.names
+        depends = self.packages_db.resolve(self.packages_db.ids[metapackage])
         if installed_only:
-            installed = set()
+            installed = self.packages_db.installed
+            packages = {names[package] for package in depends if installed[package]}
             if self.packages_db[metapackage].installed:
-                installed.update([metapackage])
-            for package in self.packages_db[metapackage].depends:
-                if package in self.packages_db:
-                    if self.packages_db[package].installed:
-                        installed.update([package])
-            return sorted(installed)
+                packages.update([metapackage])
+            return sorted(packages)
         else:
-            return sorted(self.packages_db[metapackage].depends)
+            return sorted(names[package] for package in depends)
 
     def equivalent_metapackage(self, task):
         """
@@ -251,14 +1154,12 @@ class Apt:
         """
         Return database of other tasks and overlapping packages.
         """
-        packages = set(self.installed_packages(task))
-        other_tasks = set(self.installed_tasks) | set (self.installed_metapackages)
         overlaps = {}
-        for other_task in other_tasks:
-            if other_task != task and other_task != self.equivalent_metapackage(task):
-                overlaps[other_task] = set(self.installed_packages(other_task)) & packages
+        for other_task, bits in self.overlaps.overlapping(task).items():
+            overlaps[other_task] = set(self.overlaps.names(bits))
         return overlaps
 
+    @memoized
     def installed_packages(self, task=None):
         """
         List of all installed packages or for task and/or metapackage.
@@ -273,9 +1174,7 @@ class Apt:
                 if metapackage in self.installed_metapackages:
                     installed.update([metapackage])
         else:
-            for package in self.packages_db:
-                if self.packages_db[package].installed:
-                    installed.update([package])
+            installed.update(self.installed)
         return sorted(installed)
 
     def installed_child_packages(self):
@@ -309,25 +1208,26 @@ class Apt:
             self.installed_orphan_packages())
         return sorted(packages)
 
+    @memoized
     def removable(self, task):
         """
-        Return packages safely removable from task and/or metapackage without disturbing other tasks and metapackages.
+        Return packages safely removable from task and/or metapackage without disturbing other tasks and metapackages,
+        or packages they still require.
         """
         if not task:
             system_essential_prefix = "linux-"
             packages = set()
-            for package in (set(self.installed_independent_packages()) | set(self.installed_orphan_packages())):
+            outsiders = set(self.installed_independent_packages()) | set(self.installed_orphan_packages())
+            for package in outsiders - self.dependencies.needed(outsiders):
                 if package[:6] == system_essential_prefix:
                     packages.update([package + "+"])
                 else:
                     packages.update([package])
             return sorted(packages)
         else:
-            packages = set(self.installed_packages(task))
-            overlaps = self.overlapping(task)
-            for other_task in overlaps:
-                packages -= overlaps[other_task]
-            return sorted(packages)
+            packages = self.overlaps.names(self.overlaps.removable(task))
+            needed = self.dependencies.needed(packages)
+            return [package for package in packages if package not in needed]
 
     def remove(self, task):
         """
@@ -358,8 +1258,6 @@ class Apt:
         if task in self.metapackages:
             packages.update(self.metapackage_packages(task, installed_only=True))
             packages.update([task])
-        else:
-            return
         needed = set()
         for package in packages:
             if not self.packages_db[package].installed:
@@ -380,15 +1278,150 @@ class Apt:
             else:
                 return apt_command + " " + " ".join(sorted(packages))
 
-    def symbol(self, value):
+    def summary(self, task):
         """
-        Returns a > or < symbol for rounded values not quite 100 or 0.
+        Return database of task and/or metapackage status percentages, install and remove plans, overlaps, and sizes
+        in KiB.
         """
-        return ("<" if value < 100 and value >= 99.5 else (">" if value > 0 and value < 0.5 else " "))
+        metapackage = self.equivalent_metapackage(task)
+        packages = self.installed_packages(task)
+        removable = self.removable(task)
+        return {
+            "task": task,
+            "metapackage": metapackage,
+            "task_installed": task in self.installed_tasks if task in self.tasks else None,
+            "task_percentage": self.task_status(task)[1] if task in self.tasks else None,
+            "metapackage_installed": metapackage in self.installed_metapackages if metapackage else None,
+            "metapackage_percentage": self.metapackage_status(metapackage)[1] if metapackage else None,
+            "installed": len(packages),
+            "size": self.size(packages),
+            "install": self.installable(task),
+            "remove": removable,
+            "removable_size": self.size(removable),
+            "overlaps": {other: count for other, count in sorted(self.overlaps.counts(task).items()) if count},
+        }
 
-    def report(self, orphans=False):
+    def plan_free(self, kilobytes):
+        """
+        Return removal plan of installed tasks and/or metapackages freeing at least kilobytes, or as much as possible:
+        list of tasks with freed and cumulative kilobytes in removal order, and packages to remove.
+        Lazy greedy: tasks are queued by their marginal gain, the space removing them with the tasks already chosen
+        would free beyond what those tasks free, counting packages in no other remaining task less packages still
+        required by kept packages (as removable() returns for a single task), fewest packages first on ties. Queued
+        gains go stale as tasks are chosen, so the top of the queue is re-evaluated until its gain is current. Tasks
+        overlapping a chosen task gain the packages it shared, so they are re-evaluated at once; other gains only
+        grow when a chosen task releases packages they require, and are seen when next re-evaluated.
+        """
+        overlaps = self.overlaps
+        remaining = self.installed_combined()
+        bitsets = {task: overlaps.bitset(task) for task in remaining}
+
+        def shared():
+            once = 0
+            twice = 0
+            for task in remaining:
+                twice |= once & bitsets[task]
+                once |= bitsets[task]
+            return twice
+
+        def removal(task):
+            packages = overlaps.names(freed_bits | bitsets[task] & ~twice)
+            needed = self.dependencies.needed(packages)
+            return [package for package in packages if package not in needed]
+
+        def evaluate(task):
+            evaluated[task] = removal(task)
+            latest[task] = (freed - self.size(evaluated[task]), popcount(bitsets[task]), task, len(plan))
+            heapq.heappush(queue, latest[task])
+
+        twice = shared()
+        freed_bits = 0
+        packages = []
+        freed = 0
+        plan = []
+        queue = []
+        evaluated = {}
+        latest = {}
+        for task in remaining:
+            evaluate(task)
+        while queue and freed < kilobytes:
+            entry = heapq.heappop(queue)
+            task = entry[2]
+            if task not in remaining or entry is not latest[task]:
+                continue
+            if entry[3] < len(plan):
+                evaluate(task)
+                continue
+            packages = evaluated[task]
+            freed_bits |= bitsets[task] & ~twice
+            remaining.remove(task)
+            twice = shared()
+            gain = self.size(packages) - freed
+            freed += gain
+            plan.append((task, gain, freed))
+            for other in remaining:
+                if bitsets[other] & bitsets[task]:
+                    evaluate(other)
+        return plan, packages
+
+    def free(self, kilobytes):
+        """
+        Print removal plan freeing at least kilobytes, with space freed and cumulative, and apt remove command text.
+        """
+        plan, packages = self.plan_free(kilobytes)
+        print("   freed    total  task/metapackage")
+        for task, gain, freed in plan:
+            metapackage = self.equivalent_metapackage(task)
+            if metapackage and metapackage != task and metapackage in self.installed_metapackages:
+                task = task + "/" + metapackage
+            print(human(gain * 1024).rjust(8), human(freed * 1024).rjust(8), " " + task)
+        print()
+        freed = plan[-1][2] if plan else 0
+        if freed < kilobytes:
+            print("# Removing all installed tasks and metapackages frees only " + human(freed * 1024) + ".\n")
+        if packages:
+            print("sudo apt remove " + " ".join(packages) + "\n")
+
+    def snapshot(self):
+        """
+        Return snapshot of installed state: installed packages sorted, with sizes and child, orphan or independent
+        class codes, and tasks and metapackages with any package installed, with installation, percentage, and bitset
+        of installed packages by index.
+        """
+        packages = self.installed_packages()
+        index = {package: number for number, package in enumerate(packages)}
+        classes = bytearray(len(packages))
+        for code, group in enumerate((self.installed_child_packages(), self.installed_orphan_packages(),
+                                      self.installed_independent_packages())):
+            for package in group:
+                classes[index[package]] = code
+        tasks = {}
+        for task in sorted(set(self.tasks) | set(self.metapackages)):
+            members = self.installed_packages(task)
+            if members:
+                if task in self.tasks:
+                    installed, percentage = task in self.installed_tasks, self.task_status(task)[1]
+                else:
+                    installed, percentage = task in self.installed_metapackages, self.metapackage_status(task)[1]
+                flags = bytearray(len(packages) // 8 + 1)
+                for package in members:
+                    flags[index[package] >> 3] |= 1 << (index[package] & 7)
+                tasks[task] = (installed, percentage, int.from_bytes(flags, "little"))
+        return {"time": time.time(), "root": self.root, "packages": "\n".join(packages),
+                "sizes": [self.packages_db.sizes[self.packages_db.ids[package]] for package in packages],
+                "classes": bytes(classes), "tasks": tasks}
+
+    def installed_combined(self):
         """
-        Print on task/metapackage installation statistics.
+        List installed tasks and metapackages, metapackages equivalent to installed tasks included in the task.
+        """
+        combined = set(self.installed_tasks) | set(self.installed_metapackages)
+        return sorted(task for task in combined if not (task[:7] == self._prefix and task[7:] in self.installed_tasks))
+
+    def report_rows(self, orphans=False):
+        """
+        Yield task/metapackage installation statistics for installed (or orphan) tasks and metapackages, one at a
+        time, with sizes in KiB.
         """
         installed = set(self.installed_tasks) | set(self.installed_metapackages)
         if orphans:
@@ -396,8 +1429,6 @@ class Apt:
         else:
             combined = installed
         skip = set()
-        print(" task | meta  name packages (% overlap) removable/installed")
-        print("      |  ")
         for task in sorted(combined):
             if task not in skip:
                 removable = self.size(self.removable(task))
@@ -407,46 +1438,469 @@ class Apt:
                         skip.update([metapackage])
                     else:
                         metapackage = task
-                    if task in self.tasks:
-                        percentage = self.task_status(task)[1]
-                        print((self.symbol(percentage) + str(round(percentage)) + "%").rjust(5), sep="", end="")
-                    else:
-                        print("   - ", end="")
-                    if metapackage in self.metapackages:
-                        percentage = self.metapackage_status(metapackage)[1]
-                        print(" |", (self.symbol(percentage) + str(round(percentage)) + "%").rjust(5), sep="", end="")
-                    else:
-                        print(" |   - ", sep="", end="")
-                    if task != metapackage:
-                        print("  " + task + "/" + metapackage, end="")
-                    else:
-                        print("  " + task, sep="", end="")
-                    packages = self.installed_packages(task)
-                    print("", len(packages), end="")
-                    overlaps = self.overlapping(task)
+                    bits = self.overlaps.bitset(task)
+                    overlaps = self.overlaps.counts(task)
                     overlapping_packages = 0
-                    biggest_overlap = ""
+                    biggest_overlap = None
                     for other_task in sorted(overlaps):
-                        length = len(overlaps[other_task])
+                        length = overlaps[other_task]
                         if length > overlapping_packages:
                             overlapping_packages = length
                             biggest_overlap = other_task
-                    if overlapping_packages > 0:
-                        print(" (" + str(round(overlapping_packages / len(
-                            self.installed_packages(task)) * 100)) + "% in " + biggest_overlap + ")", end="")
-                    print(" " + human(removable * 1024) + "/" + human(self.size(packages) * 1024))
-
-        installed = apt.installed_packages()
-        children = apt.installed_child_packages()
-        orphans = apt.installed_orphan_packages()
-        independent = apt.installed_independent_packages()
-        print()
-        print("              installed packages:", len(installed), "packages", human(self.size(installed) * 1024))
-        print()
-        print("              child packages:", len(children), "packages", human(self.size(children) * 1024))
-        print("              orphan packages:", len(orphans), "packages", human(self.size(orphans) * 1024))
-        print("              independent packages:", len(independent), "packages", human(self.size(independent) * 1024))
-        print()
+                    yield {
+                        "task": task,
+                        "metapackage": metapackage,
+                        "task_percentage": self.task_status(task)[1] if task in self.tasks else None,
+                        "metapackage_percentage":
+                            self.metapackage_status(metapackage)[1] if metapackage in self.metapackages else None,
+                        "packages": popcount(bits),
+                        "overlapping": overlapping_packages,
+                        "overlapping_task": biggest_overlap,
+                        "removable_size": removable,
+                        "size": self.overlaps.size(bits),
+                    }
+
+    def package_totals(self):
+        """
+        Return installed, child, orphan and independent package counts and sizes in KiB.
+        Installed packages of every task and metapackage are marked in one pass, 1 for any, 2 for installed tasks and
+        metapackages, and each class is then counted and summed over the marks column.
+        """
+        db = self.packages_db
+        installed = db.installed
+        marks = bytearray(len(db.names))
+        installed_tasks = set(self.installed_tasks)
+        for task, packages in self.task_index.items():
+            mark = 3 if task in installed_tasks else 1
+            for package in packages:
+                if installed[package]:
+                    marks[package] |= mark
+        for metapackage in itertools.compress(range(len(db.names)), db.metapackages):
+            mark = 3 if installed[metapackage] else 1
+            for package in db.resolve(metapackage):
+                if installed[package]:
+                    marks[package] |= mark
+            if installed[metapackage]:
+                marks[metapackage] |= mark
+        totals = {"installed": {"packages": sum(installed), "size": sum(itertools.compress(db.sizes, installed))}}
+        for name, table in (("child", child_marks), ("orphan", orphan_marks)):
+            flags = marks.translate(table)
+            totals[name] = {"packages": flags.count(1), "size": sum(itertools.compress(db.sizes, flags))}
+        totals["independent"] = {key: totals["installed"][key] - totals["child"][key] - totals["orphan"][key]
+                                 for key in ("packages", "size")}
+        return totals
+
+    def report_data(self, orphans=False):
+        """
+        Return task/metapackage installation statistics: installed (or orphan) tasks and metapackages, and installed,
+        child, orphan and independent package counts, with sizes in KiB.
+        """
+        return {"tasks": list(self.report_rows(orphans)), "packages": self.package_totals()}
+
+    def report(self, orphans=False):
+        """
+        Print on task/metapackage installation statistics, each task as computed.
+        """
+        print_report_rows(self.report_rows(orphans))
+        print_report_totals(self.package_totals())
+
+
+def print_report(data):
+    """
+    Print report data on task/metapackage installation statistics.
+    """
+    print_report_rows(data["tasks"])
+    print_report_totals(data["packages"])
+
+
+def print_report_rows(rows):
+    """
+    Print task/metapackage rows of report, as they are produced.
+    """
+    print(" task | meta  name packages (% overlap) removable/installed")
+    print("      |  ")
+    for row in rows:
+        for percentage, separator in ((row["task_percentage"], ""), (row["metapackage_percentage"], " |")):
+            if percentage is None:
+                print(separator + "   - ", end="")
+            else:
+                print(separator, (symbol(percentage) + str(round(percentage)) + "%").rjust(5), sep="", end="")
+        if row["task"] != row["metapackage"]:
+            print("  " + row["task"] + "/" + row["metapackage"], end="")
+        else:
+            print("  " + row["task"], sep="", end="")
+        print("", row["packages"], end="")
+        if row["overlapping"] > 0:
+            overlap = round(row["overlapping"] / row["packages"] * 100)
+            print(" (" + str(overlap) + "% in " + row["overlapping_task"] + ")", end="")
+        print(" " + human(row["removable_size"] * 1024) + "/" + human(row["size"] * 1024), flush=True)
+
+
+def print_report_totals(packages):
+    """
+    Print installed, child, orphan and independent package totals of report.
+    """
+    print()
+    print("              installed packages:", packages["installed"]["packages"], "packages",
+          human(packages["installed"]["size"] * 1024))
+    print()
+    for name in ("child", "orphan", "independent"):
+        print("              " + name + " packages:", packages[name]["packages"], "packages",
+              human(packages[name]["size"] * 1024))
+    print()
+
+
+def save_snapshot(path, data):
+    """
+    Write snapshot data to file, returning exit status. After the header naming the format version, fields are
+    little-endian and compressed with zlib: time, root and package names, package count, sizes and class codes, then
+    each task or metapackage with installation, percentage, and bitset bytes.
+    """
+    packages = data["packages"].split("\n") if data["packages"] else []
+    fields = [struct.pack("<d", data["time"]), length_prefixed(data["root"].encode()),
+              length_prefixed(data["packages"].encode()), struct.pack("<I", len(packages)),
+              struct.pack("<%dQ" % len(packages), *data["sizes"]), data["classes"],
+              struct.pack("<I", len(data["tasks"]))]
+    for task, (installed, percentage, bits) in sorted(data["tasks"].items()):
+        fields.extend((length_prefixed(task.encode()), struct.pack("<?d", installed, percentage),
+                       length_prefixed(bits.to_bytes((bits.bit_length() + 7) // 8, "little"))))
+    try:
+        with open(path, "wb") as file:
+            file.write(snapshot_magic + zlib.compress(b"".join(fields)))
+    except OSError:
+        print("Error writing \"" + path + "\"\n")
+        return 1
+    print("Snapshot of " + str(len(packages)) + " installed packages saved to " + path + ".\n")
+    return 0
+
+
+def load_snapshot(path):
+    """
+    Return snapshot data read from file, or None.
+    """
+    try:
+        with open(path, "rb") as file:
+            content = file.read()
+    except OSError:
+        print("Error reading \"" + path + "\"\n")
+        return None
+    if content[:len(snapshot_magic)] != snapshot_magic:
+        print("Error: \"" + path + "\" is not an apt-task snapshot.\n")
+        return None
+    offset = 0
+
+    def unpack(layout):
+        nonlocal offset
+        values = struct.unpack_from(layout, body, offset)
+        offset += struct.calcsize(layout)
+        return values
+
+    def field():
+        return unpack("<%ds" % unpack("<I")[0])[0]
+
+    try:
+        body = zlib.decompress(content[len(snapshot_magic):])
+        data = {"time": unpack("<d")[0], "root": field().decode(), "packages": field().decode()}
+        count = unpack("<I")[0]
+        data["packages"] = data["packages"].split("\n") if data["packages"] else []
+        data["sizes"] = list(unpack("<%dQ" % count))
+        data["classes"] = unpack("<%ds" % count)[0]
+        data["tasks"] = {}
+        for number in range(unpack("<I")[0]):
+            task = field().decode()
+            installed, percentage = unpack("<?d")
+            data["tasks"][task] = (installed, percentage, int.from_bytes(field(), "little"))
+        if len(data["packages"]) != count or offset != len(body) or \
+                max(data["classes"], default=0) >= len(package_classes):
+            raise ValueError("snapshot fields do not match")
+    except (zlib.error, struct.error, UnicodeDecodeError, ValueError):
+        print("Error: \"" + path + "\" is not an apt-task snapshot.\n")
+        return None
+    return data
+
+
+def length_prefixed(data):
+    """
+    Return bytes prefixed with their length.
+    """
+    return struct.pack("<I", len(data)) + data
+
+
+def bit_indexes(bits):
+    """
+    List indexes of set bits.
+    """
+    text = bin(bits)[:1:-1]
+    indexes = []
+    index = text.find("1")
+    while index >= 0:
+        indexes.append(index)
+        index = text.find("1", index + 1)
+    return indexes
+
+
+def diff_snapshots(old_path, new_path):
+    """
+    Print differences between two snapshots: tasks and metapackages changing status or packages, packages moving
+    between child, orphan and independent or installed and removed, and size changes, returning exit status.
+    Sorted package lists are merged in one pass.
+    """
+    old, new = load_snapshot(old_path), load_snapshot(new_path)
+    if old is None or new is None:
+        return 1
+    print(time.strftime("%Y-%m-%d %H:%M", time.localtime(old["time"])) + " to " +
+          time.strftime("%Y-%m-%d %H:%M", time.localtime(new["time"])) + "\n")
+    moves = {}
+    totals = {(snapshot, name): 0 for snapshot in ("old", "new") for name in package_classes}
+    old_packages, new_packages = old["packages"], new["packages"]
+    i = j = 0
+    while i < len(old_packages) or j < len(new_packages):
+        if j == len(new_packages) or (i < len(old_packages) and old_packages[i] < new_packages[j]):
+            package, before, after = old_packages[i], package_classes[old["classes"][i]], "removed"
+            totals["old", before] += old["sizes"][i]
+            i += 1
+        elif i == len(old_packages) or new_packages[j] < old_packages[i]:
+            package, before, after = new_packages[j], "installed", package_classes[new["classes"][j]]
+            totals["new", after] += new["sizes"][j]
+            j += 1
+        else:
+            package, before, after = old_packages[i], package_classes[old["classes"][i]], \
+                                     package_classes[new["classes"][j]]
+            totals["old", before] += old["sizes"][i]
+            totals["new", after] += new["sizes"][j]
+            i += 1
+            j += 1
+        if before != after:
+            moves.setdefault((before, after), []).append(package)
+    print("tasks/metapackages changed:")
+    for task in sorted(set(old["tasks"]) | set(new["tasks"])):
+        before = old["tasks"].get(task, (False, 0, 0))
+        after = new["tasks"].get(task, (False, 0, 0))
+        removed = {old_packages[index] for index in bit_indexes(before[2])}
+        added = {new_packages[index] for index in bit_indexes(after[2])}
+        removed, added = removed - added, added - removed
+        if before[0] != after[0] or round(before[1]) != round(after[1]) or removed or added:
+            status = "installed" if after[0] else "not installed"
+            if before[0] != after[0]:
+                status = ("installed" if before[0] else "not installed") + " -> " + status
+            print("  " + task + ": " + status + ", " + str(round(before[1])) + "% -> " + str(round(after[1])) + "%, +"
+                  + str(len(added)) + " -" + str(len(removed)) + " packages")
+    print()
+    for (before, after), packages in sorted(moves.items()):
+        print(before + " -> " + after + ": " + " ".join(packages), "\n")
+    for name in package_classes:
+        change = totals["new", name] - totals["old", name]
+        print("              " + name + " packages:", ("+" if change >= 0 else "-") + human(abs(change) * 1024),
+              "(" + human(totals["old", name] * 1024) + " -> " + human(totals["new", name] * 1024) + ")")
+    print()
+    return 0
+
+
+def host_report(path):
+    """
+    Return host name and report data for dpkg status file, against the archive database inherited by the process.
+    """
+    fleet_apt.refresh(path)
+    return os.path.basename(path), fleet_apt.report_data()
+
+
+def fleet(root, directory, cache=True, jobs=None, output="text"):
+    """
+    Print reports for a directory of per-host dpkg status files against one parsed archive, evaluated in forked
+    processes sharing the database, returning exit status.
+    """
+    import concurrent.futures
+    import json
+    import multiprocessing
+    global fleet_apt
+    try:
+        paths = sorted(entry.path for entry in os.scandir(directory) if entry.is_file() and entry.name[0] != ".")
+    except OSError:
+        print("Error reading \"" + directory + "\"\n")
+        return 1
+    fleet_apt = Apt(root=root, cache=cache)
+    for attribute in ("task_index", "metapackages", "installed", "installed_tasks", "installed_metapackages"):
+        getattr(fleet_apt, attribute)
+    jobs = min(jobs or os.cpu_count() or 1, len(paths) or 1)
+    with contextlib.ExitStack() as stack:
+        if jobs > 1:
+            executor = stack.enter_context(
+                concurrent.futures.ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")))
+            reports = executor.map(host_report, paths, chunksize=max(1, len(paths) // (jobs * 4)))
+        else:
+            reports = map(host_report, paths)
+        for host, data in reports:
+            if output == "json":
+                print(json.dumps({"host": host, **data}))
+            else:
+                print(host + ":\n")
+                print_report(data)
+    return 0
+
+
+def stanza_ranges(path, size):
+    """
+    List (path, start, end) byte ranges of about size bytes covering file, split on stanza boundaries.
+    """
+    ranges = []
+    with open(path, "rb") as file:
+        total = os.fstat(file.fileno()).st_size
+        if not total:
+            return ranges
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < total:
+                end = data.find(b"\n\n", start + size) if start + size < total else -1
+                end = total if end < 0 else end + 2
+                ranges.append((path, start, end))
+                start = end
+    return ranges
+
+
+def parse_share(connection, ranges):
+    """
+    Parse byte ranges of files in sequence in a worker process: send the names of the packages parsed, receive their
+    package IDs in the merged database, and send the package data and installed packages renumbered to them, or send
+    any error reading files.
+    """
+    db = PackageDB()
+    installed = set()
+    try:
+        for path, start, end in ranges:
+            with open(path, "rb") as file:
+                file.seek(start)
+                db.parse(file.read(end - start).splitlines(), installed)
+    except OSError as error:
+        connection.send(error)
+        return
+    connection.send(db.names)
+    ids = connection.recv()
+    connection.send((db.renumbered(ids), array("L", sorted(ids[db.ids[name]] for name in installed))))
+
+
+def received(connection):
+    """
+    Return object received from worker process connection, raising any error sent instead.
+    """
+    message = connection.recv()
+    if isinstance(message, OSError):
+        raise message
+    return message
+
+
+@functools.lru_cache(maxsize=65536)
+def relations(field):
+    """
+    Return relationship field (bytes) as a tuple of alternative package name tuples, interned, without version
+    constraints, architecture qualifiers or restrictions.
+    """
+    alternatives = []
+    for relation in field.decode().split(","):
+        names = []
+        for alternative in relation.split("|"):
+            name = alternative.split("(", 1)[0].split("[", 1)[0].split("<", 1)[0].split(":", 1)[0].strip()
+            if name and name not in names:
+                names.append(sys.intern(name))
+        if names:
+            alternatives.append(tuple(names))
+    return tuple(alternatives)
+
+
+def strongly_connected(edges):
+    """
+    Return database of nodes and strongly connected component numbers, numbered with required components first,
+    by iterative Tarjan's algorithm over database of nodes and lists of required nodes.
+    """
+    index = {}
+    low = {}
+    stack = []
+    on_stack = set()
+    components = {}
+    count = 0
+    for root in edges:
+        if root in index:
+            continue
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        work = [(root, iter(edges[root]))]
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(edges[child])))
+                    break
+                elif child in on_stack:
+                    low[node] = min(low[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    component = count
+                    count += 1
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        components[member] = component
+                        if member == node:
+                            break
+    return components
+
+
+def update(items, item, present):
+    """
+    Insert item into or remove item from sorted list.
+    """
+    index = bisect.bisect_left(items, item)
+    found = index < len(items) and items[index] == item
+    if present and not found:
+        items.insert(index, item)
+    elif not present and found:
+        del items[index]
+
+
+def popcount(bits):
+    """
+    Return number of set bits.
+    """
+    return bin(bits).count("1")
+
+
+if hasattr(int, "bit_count"):
+    popcount = int.bit_count
+
+
+def symbol(value):
+    """
+    Returns a > or < symbol for rounded values not quite 100 or 0.
+    """
+    return ("<" if value < 100 and value >= 99.5 else (">" if value > 0 and value < 0.5 else " "))
+
+
+def parse_size(text):
+    """
+    Return size in bytes for text of a number with optional binary K, M, G or T suffix (e.g. 500M, 1.5GiB).
+    """
+    import argparse
+    units = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    number = text.strip().upper()
+    for suffix in ("IB", "B"):
+        if number.endswith(suffix):
+            number = number[:-len(suffix)]
+            break
+    unit = number[-1:] if number[-1:] in units else ""
+    try:
+        size = int(float(number[:len(number) - len(unit)]) * units[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: " + text)
+    if size <= 0:
+        raise argparse.ArgumentTypeError("invalid size: " + text)
+    return size
 
 
 def human(num, suffix='B'):
@@ -465,6 +1919,7 @@ def install(target):
     """
     Install to target path and set executable permission.
     """
+    import subprocess
     if not target:
         target = install_path
     if os.path.isdir(target):
@@ -482,7 +1937,178 @@ def install(target):
         return False
 
 
+def run(apt, command, task=None, size=0):
+    """
+    Print command results, returning exit status.
+    """
+    if command in task_commands and not task:
+        print("Missing task parameter.\n")
+        return 2
+    if task and task not in apt.tasks and task not in apt.metapackages:
+        print("Unknown task.\n")
+        return 3
+    if command == "install":
+        print(apt.install(task) + "\n")
+    elif command == "remove":
+        print(apt.remove(task) + "\n")
+    elif command == "independent":
+        print(apt.remove(None) + "\n")
+    elif command == "show":
+        apt.show(task)
+    elif command == "list":
+        print("tasks installed:\n" + " ".join(apt.installed_tasks), "\n")
+        print("metapackages installed:\n" + " ".join(apt.installed_metapackages), "\n")
+    elif command == "available":
+        print("tasks available:\n" + " ".join(apt.tasks), "\n")
+        print("metapackages available:\n" + " ".join(apt.metapackages), "\n")
+    elif command == "orphans":
+        print("tasks/metapackages orphans:\n")
+        apt.report(orphans=True)
+    elif command == "free":
+        apt.free(-(-size // 1024))
+    else:
+        print("installed tasks/metapackages:\n")
+        apt.report()
+    return 0
+
+
+def run_tasks(apt, command, tasks=(), all_tasks=False, output="text", size=0):
+    """
+    Print command results for each task, or all installed tasks and metapackages, as text or streamed as one JSON
+    object per line, returning exit status.
+    """
+    import json
+    if command not in task_commands:
+        for task in tasks:
+            if task not in apt.tasks and task not in apt.metapackages:
+                print("Unknown task.\n")
+                return 3
+        return run(apt, command, None, size)
+    if all_tasks:
+        tasks = apt.installed_combined()
+        if not tasks:
+            if output == "text":
+                print("No installed tasks or metapackages.\n")
+            return 0
+    if not tasks:
+        print("Missing task parameter.\n")
+        return 2
+    status = 0
+    for task in tasks:
+        if output == "json":
+            if task not in apt.tasks and task not in apt.metapackages:
+                print(json.dumps({"task": task, "error": "Unknown task."}))
+                status = 3
+            else:
+                print(json.dumps(apt.summary(task)))
+        else:
+            status = run(apt, command, task) or status
+    return status
+
+
+def serve(root="/", cache=True, jobs=1):
+    """
+    Answer JSON command requests on a Unix socket from a resident database, reloading when apt or dpkg change.
+    """
+    import json
+    import signal
+    import socket
+    apt = Apt(root=root, cache=cache, jobs=jobs)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        if os.path.lexists(socket_path):
+            os.unlink(socket_path)
+        server.bind(socket_path)
+    except OSError:
+        print("Error binding \"" + socket_path + "\"\n")
+        exit(1)
+    finally:
+        os.umask(umask)
+    os.chmod(socket_path, 0o600)
+    server.listen(16)
+    signal.signal(signal.SIGTERM, lambda number, frame: sys.exit(0))
+    print("Serving on " + socket_path + ".")
+    try:
+        while True:
+            connection = server.accept()[0]
+            connection.settimeout(request_timeout)
+            with connection:
+                try:
+                    request = json.loads(connection.makefile("rb").readline().decode("utf-8"))
+                    command = request["command"]
+                    tasks = request.get("tasks") or ([request["task"]] if request.get("task") else [])
+                    all_tasks = bool(request.get("all"))
+                    output = request.get("format", "text")
+                    size = int(request.get("size", 0))
+                except OSError:
+                    continue
+                except (ValueError, KeyError, TypeError):
+                    response = {"status": 2, "output": "Bad request.\n"}
+                else:
+                    if request.get("root", "/") != root or command not in commands:
+                        response = {"status": None, "output": ""}
+                    else:
+                        changed = apt.changed()
+                        if changed == "lists":
+                            apt = Apt(root=root, cache=cache, jobs=jobs)
+                        elif changed == "status":
+                            apt.refresh()
+                        text = io.StringIO()
+                        with contextlib.redirect_stdout(text):
+                            status = run_tasks(apt, command, tasks, all_tasks, output, size)
+                        response = {"status": status, "output": text.getvalue()}
+                try:
+                    connection.sendall(json.dumps(response).encode("utf-8"))
+                except OSError:
+                    pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(socket_path)
+
+
+def trusted_socket(path):
+    """
+    Return whether path is a Unix socket owned by the user, and not open to other users.
+    """
+    import stat
+    try:
+        status = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISSOCK(status.st_mode) and status.st_uid == os.getuid() and not status.st_mode & 0o077
+
+
+def query(request):
+    """
+    Return response to request from a running daemon, or None if no daemon is available.
+    """
+    import json
+    import socket
+    if not trusted_socket(socket_path):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(socket_timeout)
+            connection.connect(socket_path)
+            if hasattr(socket, "SO_PEERCRED"):
+                credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+                if struct.unpack("3i", credentials)[1] != os.getuid():
+                    return None
+            connection.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            data = b"".join(iter(lambda: connection.recv(65536), b""))
+        response = json.loads(data.decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+    if response.get("status") is None:
+        return None
+    return response
+
+
 def parse_command_line():
+    import argparse
     description = "%(prog)s version " + version + ". " \
                   + "Safely remove and install Ubuntu Linux task and/or metapackage packages."
     parser = argparse.ArgumentParser(description=description, epilog="")
@@ -500,12 +2126,40 @@ def parse_command_line():
                         help="list all available tasks and metapackages")
     parser.add_argument("-s", "--show", action="store_true", dest="show",
                         help="show task and/or metapackage packages installed, available, and overlapping.")
+    parser.add_argument("--free", action="store", dest="free", type=parse_size, metavar="SIZE",
+                        help="plan task and/or metapackage removals freeing SIZE (bytes, or K, M, G suffix)")
     parser.add_argument("-R", "--report", action="store_true", dest="report",
                         help="default: report on installed tasks and metapackages")
     parser.add_argument("-o", "--report-orphans", action="store_true", dest="orphans",
                         help="report on orphan packages from tasks or metapackages not installed")
-    parser.add_argument("task", nargs="?", action="store", type=str,
-                        help="task or metapackage")
+    parser.add_argument("--no-cache", action="store_true", dest="no_cache",
+                        help="parse apt-cache without reading or writing the database cache")
+    parser.add_argument("--rebuild-cache", action="store_true", dest="rebuild_cache",
+                        help="parse apt-cache and replace the database cache")
+    parser.add_argument("--root", action="store", dest="root", default="/", metavar="DIR",
+                        help="read apt package lists and dpkg status under root directory (default: /)")
+    parser.add_argument("-j", "--jobs", action="store", dest="jobs", type=int, metavar="N",
+                        help="parse package lists, or evaluate fleet hosts, in N processes (default: 1, fleet: CPUs)")
+    parser.add_argument("--timings", action="store_true", dest="timings",
+                        help="print wall time and peak resident memory of each phase")
+    parser.add_argument("--trace-memory", action="store_true", dest="trace_memory",
+                        help="with --timings, trace peak memory allocated in each phase (slows parsing)")
+    parser.add_argument("--profile", action="store", dest="profile", metavar="FILE",
+                        help="write cProfile statistics for the run to file")
+    parser.add_argument("--snapshot", action="store", dest="snapshot", metavar="FILE",
+                        help="save compact snapshot of installed state and task membership to file")
+    parser.add_argument("--diff", action="store", dest="diff", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two snapshots: task status, package classes and sizes")
+    parser.add_argument("--fleet", action="store", dest="fleet", metavar="DIR",
+                        help="report on each host's dpkg status file in directory against the archive under root")
+    parser.add_argument("--daemon", action="store_true", dest="daemon",
+                        help="keep the database resident and answer commands on " + socket_path)
+    parser.add_argument("--all", action="store_true", dest="all_tasks",
+                        help="install, remove or show all installed tasks and metapackages")
+    parser.add_argument("--format", action="store", dest="format", choices=("text", "json"), default="text",
+                        help="install, remove or show output, json: one object per task and line (default: text)")
+    parser.add_argument("tasks", nargs="*", action="store", type=str, metavar="task",
+                        help="tasks or metapackages")
     parser.add_argument("-v", "--version", action="version", version="%(prog)s " + version,
                         help="display version and exit")
     if ".py" in sys.argv[0]:
@@ -516,41 +2170,63 @@ def parse_command_line():
 
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["--remove-configurations"]:
+        print("\n" + purge_command + "\n")
+        exit(0)
+    if ".py" in sys.argv[0] and sys.argv[1:2] == ["--setup"] and not [arg for arg in sys.argv[2:] if arg[:1] == "-"] \
+            and len(sys.argv) <= 3:
+        install(sys.argv[2] if len(sys.argv) == 3 else None)
+        exit(0)
     args = parse_command_line()
     if ".py" in sys.argv[0]:
         if args.setup:
-            install(args.task)
+            install(args.tasks[0] if args.tasks else None)
             exit(0)
-    if (args.install or args.remove or args.show) and not args.task:
+    if (args.install or args.remove or args.show) and not (args.tasks or args.all_tasks):
         print(args.__dict__)
         print("\nMissing task parameter.\n")
         exit(2)
     if args.purge:
-        print("\nsudo apt purge $(dpkg --get-selections | grep deinstall | cut -f 1)\n")
+        print("\n" + purge_command + "\n")
         exit(0)
-    print("\nParsing apt-cache ... ", end="")
-    apt = Apt()
-    print("\r                     \r", end="")
-    if args.task and args.task not in apt.tasks and args.task not in apt.metapackages:
-        print("Unknown task.\n")
-        exit(3)
-    if args.install:
-        print(apt.install(args.task) + "\n")
-    elif args.remove:
-        print(apt.remove(args.task) + "\n")
-    elif args.independent:
-        print(apt.remove(None) + "\n")
-    elif args.show:
-        apt.show(args.task)
-    elif args.list:
-        print("tasks installed:\n" + " ".join(apt.installed_tasks), "\n")
-        print("metapackages installed:\n" + " ".join(apt.installed_metapackages), "\n")
-    elif args.available:
-        print("tasks available:\n" + " ".join(apt.tasks), "\n")
-        print("metapackages available:\n" + " ".join(apt.metapackages), "\n")
-    elif args.orphans:
-        print("tasks/metapackages orphans:\n")
-        apt.report(orphans=True)
-    else:
-        print("installed tasks/metapackages:\n")
-        apt.report()
+    if args.daemon:
+        serve(args.root, cache=not args.no_cache, jobs=args.jobs or 1)
+        exit(0)
+    if args.diff:
+        exit(diff_snapshots(*args.diff))
+    if args.snapshot:
+        apt = Apt(root=args.root, cache=not args.no_cache, rebuild_cache=args.rebuild_cache, jobs=args.jobs or 1)
+        exit(save_snapshot(args.snapshot, apt.snapshot()))
+    if args.fleet:
+        exit(fleet(args.root, args.fleet, cache=not args.no_cache, jobs=args.jobs, output=args.format))
+    command = "report"
+    for name in commands:
+        if getattr(args, name):
+            command = name
+            break
+    if args.format == "json" and command not in task_commands:
+        print("\nJSON output is for install, remove and show.\n")
+        exit(2)
+    if not (args.no_cache or args.rebuild_cache or args.timings or args.profile):
+        response = query({"command": command, "tasks": args.tasks, "all": args.all_tasks, "format": args.format,
+                          "size": args.free or 0, "root": args.root})
+        if response:
+            print(("\n" if args.format == "text" else "") + response["output"], end="")
+            exit(response["status"])
+    timings = Timings(memory=args.trace_memory) if args.timings else None
+    with (profiled(args.profile) if args.profile else contextlib.nullcontext()):
+        progress = Progress() if args.format == "text" and sys.stdout.isatty() else None
+        if args.format == "text":
+            print("\nParsing apt-cache ... ", end="", flush=True)
+        apt = Apt(root=args.root, cache=not args.no_cache, rebuild_cache=args.rebuild_cache, timings=timings,
+                  jobs=args.jobs or 1, progress=progress)
+        if progress:
+            progress.clear()
+        elif args.format == "text":
+            print("\r                     \r", end="")
+        with apt.phase(command):
+            status = run_tasks(apt, command, args.tasks, args.all_tasks, args.format, args.free or 0)
+    if timings:
+        timings.report()
+        print("memoized queries:", apt.memo_info(), "\n", file=sys.stderr)
+    exit(status)
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# wolfospealain, May 2018.
+# https://github.com/wolfospealain/apt-task
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sizes = "1000,10000,100000"
+
+
+def load(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "apt-task.py")):
+    """
+    Import apt-task script as a module.
+    """
+    spec = importlib.util.spec_from_file_location("apt_task", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def generate(root, packages=1000, tasks=40, overlap=0.3, fanout=50, installed=0.4, seed=0):
+    """
+    Write synthetic apt package lists and dpkg status under root directory.
+    A third of packages belong to a task, overlap is the ratio of task packages also in a second task, fanout is the
+    number of dependencies of each task's equivalent metapackage.
+    """
+    rng = random.Random(seed)
+    task_names = ["task%d-desktop" % number for number in range(tasks)]
+    names = ["package%d" % number for number in range(packages)]
+    package_tasks = {}
+    for name in names:
+        if rng.random() < 1 / 3:
+            package_tasks[name] = rng.sample(task_names, 2 if rng.random() < overlap else 1)
+    members = {task: [] for task in task_names}
+    for name in package_tasks:
+        for task in package_tasks[name]:
+            members[task].append(name)
+    metapackages = {}
+    for task in task_names[::2]:
+        candidates = members[task] or names
+        metapackages["ubuntu-" + task] = rng.sample(candidates, min(fanout, len(candidates)))
+    installed_tasks = set(rng.sample(task_names, tasks // 5)) | {task_names[0]}
+    installed_packages = set()
+    for name in names:
+        if rng.random() < installed or installed_tasks.intersection(package_tasks.get(name, ())):
+            installed_packages.add(name)
+    for metapackage in metapackages:
+        if metapackage[7:] in installed_tasks:
+            installed_packages.add(metapackage)
+
+    def stanza(name, status=None):
+        lines = ["Package: " + name]
+        if status:
+            lines.append("Status: " + status)
+        lines.append("Priority: optional")
+        if name in metapackages:
+            lines.append("Section: metapackages")
+            lines.append("Installed-Size: %d" % rng.randint(10, 100))
+            lines.append("Depends: " + ", ".join(depend + " (>= 1.0)" for depend in metapackages[name]))
+        else:
+            lines.append("Section: utils")
+            lines.append("Installed-Size: %d" % rng.randint(1, 50000))
+            depends = rng.sample(names, min(3, len(names)))
+            lines.append("Depends: " + ", ".join(depends[:2]) + ", " + depends[2] + " | " + depends[0])
+            lines.append("Recommends: " + rng.choice(names))
+            if name in package_tasks:
+                lines.append("Task: " + ", ".join(package_tasks[name]))
+        lines.append("Version: 1.0-1")
+        lines.append("Description: synthetic package " + name)
+        lines.append(" Benchmark fixture.")
+        return "\n".join(lines) + "\n\n"
+
+    lists = os.path.join(root, "var/lib/apt/lists")
+    os.makedirs(lists, exist_ok=True)
+    os.makedirs(os.path.join(root, "var/lib/dpkg"), exist_ok=True)
+    everything = names + sorted(metapackages)
+    components = ["main", "universe", "multiverse", "restricted"]
+    for index, component in enumerate(components):
+        path = os.path.join(lists, "archive.ubuntu.com_ubuntu_dists_bionic_" + component + "_binary-amd64_Packages")
+        with open(path, "w") as file:
+            for name in everything[index::len(components)]:
+                file.write(stanza(name))
+    with open(os.path.join(root, "var/lib/dpkg/status"), "w") as file:
+        for name in everything:
+            if name in installed_packages:
+                file.write(stanza(name, "install ok installed"))
+            elif rng.random() < 0.05:
+                file.write(stanza(name, "deinstall ok config-files"))
+    return {"task": task_names[0], "tasks": sorted(installed_tasks), "metapackages": sorted(metapackages)}
+
+
+def reset(module, apt):
+    """
+    Discard cached query results and all lazily derived tables.
+    """
+    apt.invalidate()
+    for name, value in vars(module.Apt).items():
+        if isinstance(value, module.lazy):
+            apt.__dict__.pop(name, None)
+
+
+def timed(function, repeat):
+    """
+    Return best wall time in seconds of repeated calls, with standard output discarded.
+    """
+    best = None
+    for count in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def benchmark(module, root, fixture, repeat=3):
+    """
+    Return records of construction and query timings for fixture under root directory.
+    """
+    records = []
+    module.cache_path = os.path.join(root, "cache", "db.pickle")
+    records.append(("construct", timed(lambda: module.Apt(root=root, cache=False), repeat)))
+    timings = module.Timings(memory=False)
+    module.Apt(root=root, cache=False, timings=timings)
+    for record in timings.phases:
+        records.append(("construct: " + record["phase"], record["seconds"]))
+    module.Apt(root=root, rebuild_cache=True)
+    records.append(("construct (cached)", timed(lambda: module.Apt(root=root), repeat)))
+    apt = module.Apt(root=root, cache=False)
+    task = fixture["task"]
+    queries = [
+        ("task_index", lambda: apt.task_index),
+        ("installed_tasks", lambda: apt.installed_tasks),
+        ("installed_metapackages", lambda: apt.installed_metapackages),
+        ("task_status", lambda: apt.task_status(task)),
+        ("metapackage_status", lambda: apt.metapackage_status("ubuntu-" + task)),
+        ("installed_packages", lambda: apt.installed_packages(task)),
+        ("overlapping", lambda: apt.overlapping(task)),
+        ("removable", lambda: apt.removable(task)),
+        ("installed_child_packages", apt.installed_child_packages),
+        ("installed_orphan_packages", apt.installed_orphan_packages),
+        ("installed_independent_packages", apt.installed_independent_packages),
+        ("install", lambda: apt.install(task)),
+        ("remove", lambda: apt.remove(task)),
+        ("remove outsiders", lambda: apt.remove(None)),
+        ("show", lambda: apt.show(task)),
+        ("report", apt.report),
+        ("report orphans", lambda: apt.report(orphans=True)),
+    ]
+    for name, query in queries:
+        records.append((name, timed(lambda: (reset(module, apt), query()), repeat)))
+    return records
+
+
+def parse_command_line():
+    description = "Benchmark apt-task construction and queries on synthetic apt package lists and dpkg status."
+    parser = argparse.ArgumentParser(description=description, epilog="")
+    parser.add_argument("-p", "--packages", action="store", dest="packages", default=sizes,
+                        help="comma separated package counts (default: " + sizes + ")")
+    parser.add_argument("-t", "--tasks", action="store", dest="tasks", type=int, default=40,
+                        help="number of tasks (default: 40)")
+    parser.add_argument("--overlap", action="store", dest="overlap", type=float, default=0.3,
+                        help="ratio of task packages also in a second task (default: 0.3)")
+    parser.add_argument("--fanout", action="store", dest="fanout", type=int, default=50,
+                        help="metapackage dependencies (default: 50)")
+    parser.add_argument("-n", "--repeat", action="store", dest="repeat", type=int, default=3,
+                        help="repeats per timing, best kept (default: 3)")
+    parser.add_argument("-o", "--output", action="store", dest="output",
+                        help="write JSON results to file (default: standard output)")
+    parser.add_argument("--keep", action="store", dest="keep", metavar="DIR",
+                        help="generate fixtures under directory and keep them")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_command_line()
+    module = load()
+    results = {"version": module.version, "python": platform.python_version(), "tasks": args.tasks,
+               "overlap": args.overlap, "fanout": args.fanout, "repeat": args.repeat, "results": []}
+    for packages in [int(count) for count in args.packages.split(",")]:
+        root = os.path.join(args.keep, str(packages)) if args.keep else tempfile.mkdtemp(prefix="apt-task-")
+        try:
+            fixture = generate(root, packages, args.tasks, args.overlap, args.fanout)
+            for name, seconds in benchmark(module, root, fixture, args.repeat):
+                results["results"].append({"packages": packages, "operation": name, "seconds": round(seconds, 6)})
+                print(str(packages).rjust(7), name.ljust(32), "%.4fs" % seconds, file=sys.stderr)
+        finally:
+            if not args.keep:
+                shutil.rmtree(root)
+    text = json.dumps(results, indent=1)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+# wolfospealain, May 2018.
+# https://github.com/wolfospealain/apt-task
+
+import contextlib
+import io
+import itertools
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import benchmark
+
+apt_task = benchmark.load()
+
+
+def parsed(stanzas):
+    """
+    Return package database parsed from stanza text, with packages having a status field marked installed.
+    """
+    db = apt_task.PackageDB()
+    installed = set()
+    db.parse(io.BytesIO(stanzas.encode()), installed)
+    for package in installed:
+        db[package].installed = True
+    return db
+
+
+def walked(db, packages):
+    """
+    Return set of packages still required by kept installed packages, walking requirements from every kept package.
+    """
+    installed = set(itertools.compress(db.names, db.installed))
+    pending = [package for package in installed if package not in packages]
+    reached = set(pending)
+    while pending:
+        for require in db.requires[db.ids[pending.pop()]]:
+            name = db.names[require]
+            if name in installed and name not in reached:
+                reached.add(name)
+                pending.append(name)
+    return reached & set(packages)
+
+
+class RelationsTest(unittest.TestCase):
+
+    def test_alternatives(self):
+        self.assertEqual(apt_task.relations(b"a | b, c"), (("a", "b"), ("c",)))
+
+    def test_qualifiers(self):
+        self.assertEqual(apt_task.relations(b"pkg:any (>= 1) [amd64] <!nocheck>, libc6 (>= 2.27) | musl"),
+                         (("pkg",), ("libc6", "musl")))
+
+    def test_parsed_columns(self):
+        db = parsed("Package: top\nDepends: a | b, c (>= 1)\nPre-Depends: d:any\nRecommends: e [amd64]\n"
+                    "Suggests: f <!nocheck>\n\n")
+        top = db["top"]
+        self.assertEqual(top.depends, (("a", "b"), ("c",)))
+        self.assertEqual(top.recommends, (("e",),))
+        self.assertEqual(top.suggests, (("f",),))
+        self.assertEqual([db.names[package] for package in db.requires[db.ids["top"]]], ["a", "b", "c", "d"])
+
+
+class DependenciesTest(unittest.TestCase):
+
+    def setUp(self):
+        status = "Status: install ok installed\n"
+        self.db = parsed("Package: x\nDepends: y\n" + status + "\n"
+                         "Package: y\nDepends: x, base\n" + status + "\n"
+                         "Package: z\nDepends: x\n" + status + "\n"
+                         "Package: base\n" + status + "\n"
+                         "Package: loose\n" + status + "\n")
+        self.dependencies = apt_task.Dependencies(self.db)
+
+    def test_components(self):
+        ids = self.db.ids
+        components = apt_task.strongly_connected({1: [2], 2: [1, 4], 3: [1], 4: []})
+        self.assertEqual(components[1], components[2])
+        self.assertEqual(len(set(components.values())), 3)
+        self.assertLess(components[4], components[1])
+        self.assertLess(components[1], components[3])
+        self.dependencies.condense()
+        self.assertEqual(self.dependencies.components[ids["x"]], self.dependencies.components[ids["y"]])
+
+    def test_cycle_kept_whole(self):
+        self.assertEqual(self.dependencies.needed(["x", "y"]), {"x", "y"})
+        self.assertEqual(self.dependencies.needed(["y", "base"]), {"y", "base"})
+
+    def test_cycle_removed_whole(self):
+        self.assertEqual(self.dependencies.needed(["x", "y", "z"]), set())
+        self.assertEqual(self.dependencies.needed(["x", "y", "z", "base", "loose"]), set())
+        self.assertEqual(self.dependencies.needed(["loose"]), set())
+
+    def test_matches_walk(self):
+        rng = random.Random(0)
+        names = ["package%d" % number for number in range(60)]
+        stanzas = []
+        for name in names:
+            stanzas.append("Package: " + name + "\nDepends: " + ", ".join(rng.sample(names, rng.randint(0, 2)))
+                           + "\n" + ("Status: install ok installed\n" if rng.random() < 0.8 else "") + "\n")
+        db = parsed("".join(stanzas))
+        dependencies = apt_task.Dependencies(db)
+        installed = list(itertools.compress(db.names, db.installed))
+        for count in range(200):
+            packages = rng.sample(installed, rng.randint(1, len(installed)))
+            self.assertEqual(dependencies.needed(packages), walked(db, packages))
+
+
+class FixtureTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.fixture = benchmark.generate(cls.root, packages=4000, tasks=20)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.root)
+
+    def test_snapshot_round_trip(self):
+        data = apt_task.Apt(root=self.root, cache=False).snapshot()
+        path = os.path.join(self.root, "snapshot")
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(apt_task.save_snapshot(path, data), 0)
+            loaded = apt_task.load_snapshot(path)
+        self.assertEqual(loaded["packages"], data["packages"].split("\n"))
+        for field in ("time", "root", "sizes", "classes", "tasks"):
+            self.assertEqual(loaded[field], data[field])
+        with open(path, "rb") as file:
+            content = file.read()
+        with open(path, "wb") as file:
+            file.write(content[:-8])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertIsNone(apt_task.load_snapshot(path))
+
+    def test_parallel_database(self):
+        serial = apt_task.Apt(root=self.root, cache=False, jobs=1).packages_db
+        parallel = apt_task.Apt(root=self.root, cache=False, jobs=3).packages_db
+        for column in ("names", "known", "sizes", "installed", "metapackages", "tasks", "depends", "recommends",
+                       "suggests", "requires"):
+            self.assertEqual(getattr(parallel, column), getattr(serial, column), column)
+        self.assertEqual(len(parallel), len(serial))
+
+
+if __name__ == "__main__":
+    unittest.main()